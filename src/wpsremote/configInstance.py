@@ -4,6 +4,8 @@
 # This code is licensed under the GPL 2.0 license, available at the root
 # application directory.
 
+import os
+import copy
 import ConfigParser
 import path
 import types
@@ -13,18 +15,53 @@ __author__ = "Alessio Fabiani"
 __copyright__ = "Copyright 2016 Open Source Geospatial Foundation - all rights reserved"
 __license__ = "GPL"
 
+# parsed config files, keyed by (path, mtime, size, case_sensitive, raw, variables)
+_CONFIG_CACHE = {}
+
 
 def create(filePath, moreSerchPath=[], variables={}, raw=False, case_sensitive=False):
 
+    config = _new_config(variables, raw, case_sensitive)
+    fp = open(filePath)
+    config.readfp(fp)
+    fp.close()
+
+    return _bind_helpers(config)
+
+
+def create_cached(filePath, variables={}, raw=False, case_sensitive=False):
+    """
+    Same as create(), but the parsed content of the file is kept in memory and
+    reused until the file changes on disk (mtime or size). Each call returns a
+    new config object, so callers are free to modify it.
+    """
+    st = os.stat(filePath)
+    key = (str(filePath), st.st_mtime, st.st_size, case_sensitive, raw, tuple(sorted(variables.items())))
+    cached = _CONFIG_CACHE.get(key)
+    if cached is None:
+        config = create(filePath, variables=variables, raw=raw, case_sensitive=case_sensitive)
+        # drop entries of older versions of the same file
+        for k in [k for k in _CONFIG_CACHE if k[0] == key[0]]:
+            del _CONFIG_CACHE[k]
+        _CONFIG_CACHE[key] = (copy.deepcopy(config._defaults), copy.deepcopy(config._sections))
+        return config
+
+    config = _new_config(variables, raw, case_sensitive)
+    config._defaults = copy.deepcopy(cached[0])
+    config._sections = copy.deepcopy(cached[1])
+    return _bind_helpers(config)
+
+
+def _new_config(variables, raw, case_sensitive):
     config = ConfigParser.ConfigParser(allow_no_value=raw, defaults=variables)
 
     # force config lookup paramters to be to case sensitive
     if case_sensitive:
         config.optionxform = lambda option: option
-    fp = open(filePath)
-    config.readfp(fp)
-    fp.close()
+    return config
+
 
+def _bind_helpers(config):
     config.items_without_defaults = types.MethodType(items_without_defaults, config)
     config.get_list = types.MethodType(get_list_impl, config)
     config.get_list_list = types.MethodType(get_list_list_impl, config)
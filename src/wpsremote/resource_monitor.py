@@ -22,6 +22,15 @@ class ResourceMonitor(threading.Thread):
     cores = psutil.cpu_count()
     cpu_perc = []
     vmem_perc = []
+    # (cpu, vmem, time) published by the last completed scan; the tuple is replaced
+    # as a whole, so readers get consistent values without taking the lock
+    snapshot = (None, None, None)
+    # (time, cpu, vmem) read while no recent scan is available
+    live_sample = None
+    live_sample_ttl = 1.0
+    # proc_is_running results, keyed by process definitions: (time, result)
+    proc_is_running_cache = {}
+    proc_is_running_ttl = 5.0
     lock = threading.Lock()
 
     def __init__(self, load_average_scan_minutes):
@@ -37,51 +46,86 @@ class ResourceMonitor(threading.Thread):
 
         ResourceMonitor.lock.release()
 
+    def last_sample(self):
+        """
+        Return the (cpu, vmem) percentages published by the last scan. Until the first
+        scan completes, or if the last one is older than two scan intervals, live values
+        are read instead, at most once per second.
+        """
+        cpu, vmem, ts = ResourceMonitor.snapshot
+        now = time.time()
+        if ts is not None and now - ts <= 2 * ResourceMonitor.load_average_scan_minutes * 60:
+            return (cpu, vmem)
+
+        live = ResourceMonitor.live_sample
+        if live is None or now - live[0] > ResourceMonitor.live_sample_ttl:
+            live = (now, psutil.cpu_percent(interval=0, percpu=False), psutil.virtual_memory().percent)
+            ResourceMonitor.live_sample = live
+        return live[1:]
+
+    @staticmethod
+    def parse_proc_defs(proc_defs):
+        """
+        Convert the process definitions of the 'process_blacklist' option, a list of
+        {"name": ..., "cwd": ..., "cmdline": ...} dicts, into a frozenset of
+        (name, cwd, cmdline) tuples, as expected by proc_is_running.
+        Definitions that are not dicts, or lack one of the keys, can never match and are dropped.
+        """
+        return frozenset((_p['name'], _p['cwd'], _p['cmdline']) for _p in proc_defs
+                         if isinstance(_p, dict) and 'name' in _p and 'cwd' in _p and 'cmdline' in _p)
+
     def proc_is_running(self, proc_defs):
+        """
+        Return True if one of the processes described by proc_defs (see parse_proc_defs)
+        is running. The process table is scanned at most once every 5 seconds for the same proc_defs.
+        """
+        if not proc_defs:
+            return False
+
+        now = time.time()
+        cached = ResourceMonitor.proc_is_running_cache.get(proc_defs)
+        if cached is not None and now - cached[0] < ResourceMonitor.proc_is_running_ttl:
+            return cached[1]
+
+        result = self._scan_processes(proc_defs)
+        ResourceMonitor.proc_is_running_cache[proc_defs] = (now, result)
+        return result
+
+    def _scan_processes(self, proc_defs):
         for proc in psutil.process_iter():
             try:
                 process = psutil.Process(proc.pid)  # Get the process info using PID
-                if process.is_running():
-                    pid = str(process.pid)  # noqa
-                    ppid = str(process.ppid)  # noqa
-                    status = process.status()  # noqa
-
-                    cpu_percent = process.cpu_percent()  # noqa
-                    mem_percent = process.memory_percent()  # noqa
-
-                    rss = str(process.memory_info().rss)  # noqa
-                    vms = str(process.memory_info().vms)  # noqa
-                    username = process.username()  # noqa
+                if process.is_running() and process.status().lower() != "sleeping":
                     name = process.name()  # Here is the process name
-                    path = process.cwd()  # noqa
-                    cmdline = ' '.join(process.cmdline())  # noqa
-
-                    print("Get the process info using (path, name, cmdline): [%s / %s / %s]" % (path, name, cmdline))
-                    for _p in proc_defs:
-                        # logger.info("Look for process: [%s] / Status [%s]" % (_p, status.lower()))
-                        # print("Look for process: [%s] / Status [%s]" % (_p, status.lower()))
-                        if (status.lower() != "sleeping") and \
-                            ('name' in _p and _p['name'] in name) and \
-                                ('cwd' in _p and _p['cwd'] in path) and \
-                                ('cmdline' in _p and _p['cmdline'] in cmdline):
+                    path = process.cwd()
+                    cmdline = ' '.join(process.cmdline())
+
+                    logger.debug("Get the process info using (path, name, cmdline): [%s / %s / %s]",
+                                 path, name, cmdline)
+                    for (_name, _cwd, _cmdline) in proc_defs:
+                        if _name in name and _cwd in path and _cmdline in cmdline:
                             return True
-            except BaseException:
-                import traceback
-                tb = traceback.format_exc()
-                logger.debug(tb)
-                print(tb)
+            except psutil.Error:
+                # e.g. AccessDenied reading the cwd of processes of other users
+                logger.debug("Could not read the process info", exc_info=True)
         return False
 
     def update_stats(self):
         ResourceMonitor.lock.acquire()
 
-        ResourceMonitor.vmem_perc[1] = (ResourceMonitor.vmem_perc[0] + ResourceMonitor.vmem_perc[1]) / 2.0
-        ResourceMonitor.vmem_perc[0] = (ResourceMonitor.vmem_perc[1] + psutil.virtual_memory().percent) / 2.0
-
         ResourceMonitor.cpu_perc[1] = ResourceMonitor.cpu_perc[0]
         ResourceMonitor.cpu_perc[0] = psutil.cpu_percent(
             interval=(ResourceMonitor.load_average_scan_minutes*60), percpu=False)
 
+        # sample the memory after the (blocking) cpu scan, so that it is fresh when published
+        vmem = psutil.virtual_memory().percent
+        ResourceMonitor.vmem_perc[1] = (ResourceMonitor.vmem_perc[0] + ResourceMonitor.vmem_perc[1]) / 2.0
+        ResourceMonitor.vmem_perc[0] = (ResourceMonitor.vmem_perc[1] + vmem) / 2.0
+
+        ResourceMonitor.snapshot = (ResourceMonitor.cpu_perc[0],
+                                    (vmem + ResourceMonitor.vmem_perc[0]) / 2.0,
+                                    time.time())
+
         ResourceMonitor.lock.release()
 
     def run(self):
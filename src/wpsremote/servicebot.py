@@ -4,19 +4,23 @@
 # This code is licensed under the GPL 2.0 license, available at the root
 # application directory.
 
+import os
 import re
-import psutil
-import thread
+import sys
+import json
+import time
 import logging
+import threading
 import datetime
 import tempfile
 import subprocess
 import introspection
 
-from collections import OrderedDict
+from collections import deque
 
 import busIndipendentMessages
 
+import ConfigParser
 import configInstance
 import computation_job_inputs
 import output_parameters
@@ -27,6 +31,74 @@ __author__ = "Alessio Fabiani"
 __copyright__ = "Copyright 2016 Open Source Geospatial Foundation - all rights reserved"
 __license__ = "GPL"
 
+_run_logger = logging.getLogger("servicebot.run")
+_sender_logger = logging.getLogger("servicebot.sender")
+_invite_logger = logging.getLogger("servicebot.handle_invite")
+_execute_logger = logging.getLogger("servicebot.handle_execute")
+_getloadavg_logger = logging.getLogger("servicebot.handle_getloadavg")
+_output_parser_logger = logging.getLogger("servicebot.output_parser_verbose")
+_send_error_logger = logging.getLogger("ServiceBot.send_error_message")
+
+# tags written on stdout by the process bot when it can't send an error message itself
+# (the process bot stdout is read as raw bytes, the patterns are bytes as well)
+_TAG_RE = re.compile(b'<UID>(.*)</UID>.*<JID>(.*)</JID>.*<MSG>(.*)</MSG>', re.IGNORECASE)
+_UID_RE = re.compile(b'<UID>(.*)</UID>', re.IGNORECASE)
+_JID_RE = re.compile(b'<JID>(.*)</JID>', re.IGNORECASE)
+_MSG_RE = re.compile(b'<MSG>(.*)</MSG>', re.IGNORECASE)
+
+
+def parse_process_stdout(read_chunk, log_line=None):
+    """
+    Read the process bot stdout through read_chunk(), which returns its next block of
+    bytes (an empty one at the end of the stream), up to the end of the stream or the
+    'send error msg complete' line. Each line is passed to log_line, if given.
+    Return the last (UID, JID, MSG) tags found, None for the missing ones.
+    """
+    gs_UID = None
+    gs_JID = None
+    gs_MSG = None
+    # the stdout is read in large blocks and split in lines here,
+    # instead of paying a readline call for each line
+    tail = b''
+    end_of_stream = False
+    while not end_of_stream:
+        try:
+            chunk = read_chunk()
+            if chunk:
+                stdout_lines = (tail + chunk).split(b'\n')
+                tail = stdout_lines.pop()
+            else:
+                stdout_lines = [tail] if tail else []
+                end_of_stream = True
+
+            for line in stdout_lines:
+                if b'send error msg complete' in line:
+                    end_of_stream = True
+                    break
+
+                # Look for GeoServer JID from Process (cheap substring test first, most lines have no tags)
+                if b'<UID>' in line:
+                    gs_TAG_search = _TAG_RE.search(line)
+                    if gs_TAG_search:
+                        gs_UID, gs_JID, gs_MSG = gs_TAG_search.groups()
+                    else:
+                        # tags not all in the expected order, look for them one by one
+                        gs_UID_search = _UID_RE.search(line)
+                        if gs_UID_search:
+                            gs_UID = gs_UID_search.group(1)
+                            gs_JID_search = _JID_RE.search(line)
+                            if gs_JID_search:
+                                gs_JID = gs_JID_search.group(1)
+                                gs_MSG_search = _MSG_RE.search(line)
+                                if gs_MSG_search:
+                                    gs_MSG = gs_MSG_search.group(1)
+
+                if log_line:
+                    log_line(line)
+        except SystemExit:
+            break
+    return gs_UID, gs_JID, gs_MSG
+
 
 class ServiceBot(object):
     """
@@ -39,7 +111,7 @@ class ServiceBot(object):
 
         # read remote config file
         self._remote_config_filepath = remote_config_filepath
-        remote_config = configInstance.create(self._remote_config_filepath)
+        remote_config = configInstance.create_cached(self._remote_config_filepath)
         # identify the class implementation of the cominication bus
         bus_class_name = remote_config.get("DEFAULT", "bus_class_name")
         # directory used to store file for resource cleaner
@@ -59,12 +131,12 @@ class ServiceBot(object):
         # (request hanlder); for example the unique execution id value to craete
         # the sand box directory
         self._service_config_file = service_config_filepath
-        serviceConfig = configInstance.create(service_config_filepath,
-                                              case_sensitive=True,
-                                              variables={
-                                                'wps_execution_shared_dir': self._wps_execution_shared_dir
-                                              },
-                                              raw=True)
+        serviceConfig = configInstance.create_cached(service_config_filepath,
+                                                     case_sensitive=True,
+                                                     variables={
+                                                        'wps_execution_shared_dir': self._wps_execution_shared_dir
+                                                     },
+                                                     raw=True)
         self.service = serviceConfig.get("DEFAULT", "service")  # WPS service name?
         self.namespace = serviceConfig.get("DEFAULT", "namespace")
         self.description = serviceConfig.get("DEFAULT", "description")  # WPS service description
@@ -72,25 +144,37 @@ class ServiceBot(object):
         self._output_dir = serviceConfig.get_path("DEFAULT", "output_dir")
         self._max_running_time = datetime.timedelta(seconds=serviceConfig.getint("DEFAULT", "max_running_time_seconds"))
 
+        # command line of the process bots, only the parameters file changes between executions
+        self._wpsagent_argv_prefix = [sys.executable, 'wpsagent.py',
+                                      '-r', str(self._remote_config_filepath),
+                                      '-s', str(self._service_config_file),
+                                      '-p']
+        self._wpsagent_argv_suffix = ['process']
+
         try:
-            import json
-            self._process_blacklist = json.loads(serviceConfig.get("DEFAULT", "process_blacklist"))
-        except BaseException:
-            self._process_blacklist = []
-
-        input_sections = OrderedDict()
-        for input_section in [s for s in serviceConfig.sections() if 'input' in s.lower() or 'const' in s.lower()]:
-            # service bot doesn't have yet the execution unique id, thus the
-            # serviceConfig is read with raw=True to avoid config file variables
-            # interpolation
-            input_sections[input_section] = serviceConfig.items_without_defaults(input_section, raw=True)
+            self._process_blacklist = resource_monitor.ResourceMonitor.parse_proc_defs(
+                json.loads(serviceConfig.get("DEFAULT", "process_blacklist")))
+        except (ConfigParser.NoOptionError, ValueError, TypeError):
+            self._process_blacklist = frozenset()
+
+        # service bot doesn't have yet the execution unique id, thus the
+        # serviceConfig is read with raw=True to avoid config file variables
+        # interpolation
+        # create_from_config() sorts the sections by name, no need to keep their order here
+        input_sections = {}
+        output_sections = {}
+        for section in serviceConfig.sections():
+            section_lower = section.lower()
+            if 'input' in section_lower or 'const' in section_lower:
+                input_sections[section] = serviceConfig.items_without_defaults(section, raw=True)
+            if 'output' in section_lower:
+                output_sections[section] = serviceConfig.items_without_defaults(section, raw=True)
         self._input_parameters_defs = computation_job_inputs.ComputationJobInputs.create_from_config(input_sections)
-
-        output_sections = OrderedDict()
-        for output_section in [s for s in serviceConfig.sections() if 'output' in s.lower()]:
-            output_sections[output_section] = serviceConfig.items_without_defaults(output_section, raw=True)
         self._output_parameters_defs = output_parameters.OutputParameters.create_from_config(
             output_sections, self._wps_execution_shared_dir)
+        # the parameters definitions never change, serialize them once for all the invite messages
+        self._input_dlr = self._input_parameters_defs.as_DLR_protocol()
+        self._output_dlr = self._output_parameters_defs.as_DLR_protocol()
 
         # create the concrete bus object
         self.bus = introspection.get_class_three_arg(bus_class_name, remote_config, self.service, self.namespace)
@@ -108,11 +192,23 @@ class ServiceBot(object):
         # send the process bot (aka request handler) stdout to service bot (remote wps agent) log file
         self._redirect_process_stdout_to_logger = True
         self._remote_wps_endpoint = None
+        # last time the bus connection state has been checked
+        self._last_connected_check = 0
+
+        # outgoing messages are converted and handed to the bus by a dedicated thread; the
+        # XMPP bus queues them itself, this only takes the conversion (payload encoding)
+        # off the bus callbacks and the output parser threads
+        self._send_queue = deque()
+        self._send_event = threading.Event()
+        self._sender_running = True
+        self._sender = threading.Thread(target=self._sender_loop, name="servicebot-sender")
+        self._sender.daemon = True
+        self._sender.start()
 
         # Allocate and start a Resource Monitoring Thread
         try:
             load_average_scan_minutes = serviceConfig.getint("DEFAULT", "load_average_scan_minutes")
-        except BaseException:
+        except (ConfigParser.NoOptionError, ValueError, TypeError):
             load_average_scan_minutes = 15
         self._resource_monitor = resource_monitor.ResourceMonitor(load_average_scan_minutes)
         self._resource_monitor.start()
@@ -127,7 +223,7 @@ class ServiceBot(object):
         return self._max_running_time
 
     def run(self):
-        logger = logging.getLogger("servicebot.run")
+        logger = _run_logger
         if self._active:
             logger.info("Start listening on bus")
             self.bus.Listen()
@@ -135,39 +231,68 @@ class ServiceBot(object):
             logger.error("This service is disabled, exit process")
             return
 
+    def _ensure_connected(self):
+        """Reconnect the bus if it is not connected; the state is checked at most once per second."""
+        now = time.time()
+        if now - self._last_connected_check < 1.0:
+            return
+        self._last_connected_check = now
+        if self.bus.state() != 'connected':
+            self.bus.xmpp.reconnect()
+            self.bus.xmpp.send_presence()
+
+    def _enqueue_send(self, message):
+        self._send_queue.append(message)
+        self._send_event.set()
+
+    def _flush_send_queue(self):
+        logger = _sender_logger
+        while self._send_queue:
+            message = self._send_queue.popleft()
+            try:
+                self.bus.SendMessage(message)
+            except Exception:
+                recipient = message.originator() if callable(message.originator) else message.originator
+                logger.info("[XMPP Disconnected]: Service %s Could not send %s to %s (GeoServer Endpoint %s)",
+                            self.service, type(message).__name__, recipient, self._remote_wps_endpoint)
+
+    def _sender_loop(self):
+        while self._sender_running:
+            self._send_event.wait()
+            self._send_event.clear()
+            self._flush_send_queue()
+        # send whatever is left before exiting
+        self._flush_send_queue()
+
     def handle_invite(self, invite_message):
         """Handler for WPS invite message."""
-        logger = logging.getLogger("servicebot.handle_invite")
-        logger.info("handle invite message from WPS " + str(invite_message.originator()))
+        logger = _invite_logger
+        logger.info("handle invite message from WPS %s", invite_message.originator())
         try:
-            if self.bus.state() != 'connected':
-                self.bus.xmpp.reconnect()
-                self.bus.xmpp.send_presence()
-            self.bus.SendMessage(
+            self._ensure_connected()
+            self._enqueue_send(
                 busIndipendentMessages.RegisterMessage(invite_message.originator(),
                                                        self.service,
                                                        self.namespace,
                                                        self.description,
-                                                       self._input_parameters_defs.as_DLR_protocol(),
-                                                       self._output_parameters_defs.as_DLR_protocol()
+                                                       self._input_dlr,
+                                                       self._output_dlr
                                                        )
             )
-        except BaseException:
-            logger.info("[XMPP Disconnected]: Service " +
-                        str(self.service) +
-                        " Could not send info message to GeoServer Endpoint " +
-                        str(self._remote_wps_endpoint))
+        except Exception:
+            logger.info("[XMPP Disconnected]: Service %s Could not send info message to GeoServer Endpoint %s",
+                        self.service, self._remote_wps_endpoint)
 
     def handle_execute(self, execute_message):
         """Handler for WPS execute message."""
-        logger = logging.getLogger("servicebot.handle_execute")
+        logger = _execute_logger
 
         # save execute messsage to tmp file to enable the process bot to read the inputs
         tmp_file = tempfile.NamedTemporaryFile(prefix='wps_params_', suffix=".tmp", delete=False)
         execute_message.serialize(tmp_file)
         param_filepath = tmp_file.name
         tmp_file.close()
-        logger.debug("save parameters file for executing process " + self.service + " in " + param_filepath)
+        logger.debug("save parameters file for executing process %s in %s", self.service, param_filepath)
 
         # create the Resource Cleaner file containing the process info. The
         # "invoked_process.pid" will be set by the spawned process itself
@@ -178,48 +303,51 @@ class ServiceBot(object):
             # ... and save to file
             logger.info("Start the resource cleaner!")
             r.write()
-        except Exception as ex:
-            logger.exception("Resource Cleaner initialization error", ex)
+        except Exception:
+            logger.exception("Resource Cleaner initialization error")
 
         # invoke the process bot (aka request handler) asynchronously
-        cmd = 'python wpsagent.py -r ' + self._remote_config_filepath + ' -s ' + \
-            self._service_config_file + ' -p ' + param_filepath + ' process'
-        invoked_process = subprocess.Popen(args=cmd.split(),
-                                           stdin=subprocess.PIPE,
-                                           stdout=subprocess.PIPE,
-                                           stderr=subprocess.STDOUT)
-        logger.info("created process " + self.service + " with PId " + str(invoked_process.pid) + " and cmd: " + cmd)
+        argv = self._wpsagent_argv_prefix + [param_filepath] + self._wpsagent_argv_suffix
+        # the process bot never reads its stdin
+        devnull = open(os.devnull, 'rb')
+        try:
+            invoked_process = subprocess.Popen(args=argv,
+                                               stdin=devnull,
+                                               stdout=subprocess.PIPE,
+                                               stderr=subprocess.STDOUT,
+                                               close_fds=(os.name == 'posix'))
+        finally:
+            devnull.close()
+        logger.info("created process %s with PId %s and cmd: %s", self.service, invoked_process.pid, ' '.join(argv))
 
         # use a parallel thread to wait the end of the request handler process and
         # get the exit code of the just created asynchronous process computation
-        thread.start_new_thread(self.output_parser_verbose, (invoked_process, param_filepath,))
+        parser = threading.Thread(target=self.output_parser_verbose,
+                                  args=(invoked_process, param_filepath,),
+                                  name="servicebot-output-parser-%d" % invoked_process.pid)
+        parser.daemon = True
+        parser.start()
 
         logger.info("end of execute message handler, going back in listening mode")
 
     def handle_getloadavg(self, getloadavg_message):
         """Handler for WPS 'getloadavg' message."""
-        logger = logging.getLogger("servicebot.handle_getloadavg")
-        logger.info("handle getloadavg message from WPS " + str(getloadavg_message.originator()))
+        logger = _getloadavg_logger
+        logger.info("handle getloadavg message from WPS %s", getloadavg_message.originator())
         # Collect current Machine Load Average and Available Memory info
 
         try:
             logger.info("Fetching updated status from Resource Monitor...")
 
-            vmem = psutil.virtual_memory().percent
-            if self._resource_monitor.vmem_perc[0] > 0:
-                vmem = (vmem + self._resource_monitor.vmem_perc[0]) / 2.0
-
-            loadavg = psutil.cpu_percent(interval=0, percpu=False)
-            if self._resource_monitor.cpu_perc[0] > 0:
-                loadavg = (loadavg + self._resource_monitor.cpu_perc[0]) / 2.0
+            loadavg, vmem = self._resource_monitor.last_sample()
 
-            logger.info("Scanning Running Process. Declared Black List: %s" % self._process_blacklist)
+            logger.info("Scanning Running Process. Declared Black List: %s", self._process_blacklist)
             if self._resource_monitor.proc_is_running(self._process_blacklist):
                 logger.info("A process listed in blacklist is running! Setting loadavg and vmem to (100.0, 100.0)")
                 loadavg = 100.0
                 vmem = 100.0
             else:
-                logger.info("No blacklisted process was found. Setting loadavg and vmem to (%s, %s)" % (loadavg, vmem))
+                logger.info("No blacklisted process was found. Setting loadavg and vmem to (%s, %s)", loadavg, vmem)
 
             outputs = dict()
             outputs['loadavg'] = [loadavg, 'Average Load on CPUs during the last 15 minutes.']
@@ -227,123 +355,94 @@ class ServiceBot(object):
 
             # Send the message back to the WPS
             try:
-                if self.bus.state() != 'connected':
-                    self.bus.xmpp.reconnect()
-                    self.bus.xmpp.send_presence()
-                self.bus.SendMessage(
+                self._ensure_connected()
+                self._enqueue_send(
                     busIndipendentMessages.LoadAverageMessage(
                         getloadavg_message.originator(),
                         outputs
                     )
                 )
-            except BaseException:
-                logger.info("[XMPP Disconnected]: Service "+str(self.service) +
-                            " Could not send info message to GeoServer Endpoint "+str(self._remote_wps_endpoint))
-        except Exception as ex:
-            logger.exception("Load Average initialization error", ex)
+            except Exception:
+                logger.info("[XMPP Disconnected]: Service %s Could not send info message to GeoServer Endpoint %s",
+                            self.service, self._remote_wps_endpoint)
+        except Exception:
+            logger.exception("Load Average initialization error")
 
     def output_parser_verbose(self, invoked_process, param_filepath):
-        logger = logging.getLogger("servicebot.output_parser_verbose")
-        logger.info("wait for end of execution of created process " +
-                    self.service + ", PId " + str(invoked_process.pid))
-
-        gs_UID = None
-        gs_JID = None
-        gs_MSG = None
-        while True:
-            try:
-                line = invoked_process.stdout.readline()
-                if line != '' and 'send error msg complete' not in line:
-                    # Look for GeoServer JID from Process
-                    gs_UID_search = re.search('<UID>(.*)</UID>', line, re.IGNORECASE)
-                    gs_JID_search = re.search('<JID>(.*)</JID>', line, re.IGNORECASE)
-                    if gs_UID_search:
-                        try:
-                            gs_UID = gs_UID_search.group(1)
-                            gs_JID = gs_JID_search.group(1)
-                            gs_MSG = gs_JID_search = re.search('<MSG>(.*)</MSG>', line, re.IGNORECASE).group(1)
-                        except BaseException:
-                            pass
-
-                    if self._redirect_process_stdout_to_logger:
-                        line = line.strip()
-                        logger.debug("[SERVICE] " + line)
-                else:
-                    logger.debug("created process " + self.service + ", PId " +
-                                 str(invoked_process.pid) + " stopped send data on stdout")
-                    break  # end of stream
-            except SystemExit:
-                break
-
-        # wait for process exit code
-        return_code = -1
-        poll = invoked_process.poll()
-        if poll:
-            return_code = poll
+        logger = _output_parser_logger
+        logger.info("wait for end of execution of created process %s, PId %s", self.service, invoked_process.pid)
+
+        # skip even the strip() of each line when its debug record would be discarded
+        if self._redirect_process_stdout_to_logger and logger.isEnabledFor(logging.DEBUG):
+            def log_line(line):
+                logger.debug("[SERVICE] %s", line.strip())
         else:
-            from threading import Timer
-            timer = Timer(10, invoked_process.kill)
-            try:
-                timer.start()
-                # stdout, stderr = invoked_process.communicate()
-                return_code = invoked_process.wait()
-            finally:
-                timer.cancel()
+            log_line = None
+        stdout_fd = invoked_process.stdout.fileno()
+        gs_UID, gs_JID, gs_MSG = parse_process_stdout(lambda: os.read(stdout_fd, 1 << 16), log_line)
+        logger.debug("created process %s, PId %s stopped send data on stdout", self.service, invoked_process.pid)
+
+        # wait for process exit code, killing the process if it doesn't exit within 10 seconds
+        # (Popen.wait() has no timeout on Python 2)
+        return_code = invoked_process.poll()
+        deadline = time.time() + 10
+        while return_code is None and time.time() < deadline:
+            time.sleep(0.05)
+            return_code = invoked_process.poll()
+        if return_code is None:
+            invoked_process.kill()
+            return_code = invoked_process.wait()
 
         if return_code != 0:
             msg = "Process " + self.service + " PId " + \
                 str(invoked_process.pid) + " terminated with exit code " + str(return_code)
             logger.critical(msg)
-            logger.debug("gs_UID[%s] / gs_JID[%s]" % (gs_UID, gs_JID))
+            logger.debug("gs_UID[%s] / gs_JID[%s]", gs_UID, gs_JID)
             try:
+                self._ensure_connected()
                 if gs_UID and gs_JID:
-                    self.bus.SendMessage(busIndipendentMessages.ErrorMessage(
+                    self._enqueue_send(busIndipendentMessages.ErrorMessage(
                         gs_JID, msg + " Exception: " + str(gs_MSG), gs_UID))
                 elif self._remote_wps_endpoint:
-                    self.bus.SendMessage(busIndipendentMessages.ErrorMessage(self._remote_wps_endpoint, msg))
+                    self._enqueue_send(busIndipendentMessages.ErrorMessage(self._remote_wps_endpoint, msg))
                 else:
                     exe_msg = None
                     try:
                         logger.debug("Trying to recover Originator from Process Params!")
                         exe_msg = busIndipendentMessages.ExecuteMessage.deserialize(param_filepath)
                         if exe_msg.originator():
-                            self.bus.SendMessage(busIndipendentMessages.
-                                                 ErrorMessage(exe_msg.originator(),
-                                                              msg +
-                                                              " Exception: remote process exception. Please check outputs!",
-                                                              exe_msg.UniqueId()))
-                    except BaseException:
+                            self._enqueue_send(busIndipendentMessages.
+                                               ErrorMessage(exe_msg.originator(),
+                                                            msg +
+                                                            " Exception: remote process exception. Please check outputs!",
+                                                            exe_msg.UniqueId()))
+                    except Exception:
                         pass
                     if not exe_msg:
-                        msg = "Process " + self.service + " PId " + \
-                            str(invoked_process.pid) + " STALLED! Don't know who to send ERROR Message..."
-                        logger.error(msg)
-            except BaseException:
-                logger.info("[XMPP Disconnected]: Service " +
-                            str(self.service) +
-                            " Could not send error message to GeoServer Endpoint " +
-                            str(self._remote_wps_endpoint))
+                        logger.error("Process %s PId %s STALLED! Don't know who to send ERROR Message...",
+                                     self.service, invoked_process.pid)
+            except Exception:
+                logger.info("[XMPP Disconnected]: Service %s Could not send error message to GeoServer Endpoint %s",
+                            self.service, self._remote_wps_endpoint)
         else:
-            msg = "Process " + self.service + " PId " + str(invoked_process.pid) + " terminated successfully!"
-            logger.debug(msg)
+            logger.debug("Process %s PId %s terminated successfully!", self.service, invoked_process.pid)
 
     def send_error_message(self, msg):
-        logger = logging.getLogger("ServiceBot.send_error_message")
+        logger = _send_error_logger
         logger.error(msg)
         try:
-            if self.bus.state() != 'connected':
-                self.bus.xmpp.reconnect()
-                self.bus.xmpp.send_presence()
+            self._ensure_connected()
             if self._remote_wps_endpoint:
-                self.bus.SendMessage(busIndipendentMessages.ErrorMessage(self._remote_wps_endpoint, msg))
+                self._enqueue_send(busIndipendentMessages.ErrorMessage(self._remote_wps_endpoint, msg))
             else:
-                msg = "Process " + str(self.service) + " STALLED! Don't know who to send ERROR Message..."
-                logger.error(msg)
-        except BaseException:
-            logger.info("[XMPP Disconnected]: Service " +
-                        str(self.service) +
-                        " Could not send error message to GeoServer Endpoint " +
-                        str(self._remote_wps_endpoint))
+                logger.error("Process %s STALLED! Don't know who to send ERROR Message...", self.service)
+        except Exception:
+            logger.info("[XMPP Disconnected]: Service %s Could not send error message to GeoServer Endpoint %s",
+                        self.service, self._remote_wps_endpoint)
 
     def disconnect(self):
+        # flush the pending outgoing messages before closing the bus
+        self._sender_running = False
+        self._send_event.set()
+        self._sender.join(10)
         self.bus.disconnect()
@@ -69,7 +69,8 @@ class WPSAgent(object):
             if '\\' in defaults['workdir']:
                 defaults['workdir'] = defaults['workdir'].replace('\\', '/')
 
-        logging.config.fileConfig(str(logger_config_file), defaults=defaults)
+        # keep the module level loggers created at import time (servicebot, resource_monitor) enabled
+        logging.config.fileConfig(str(logger_config_file), defaults=defaults, disable_existing_loggers=False)
 
         logger = logging.getLogger("main.create_logger")
         if not verbose:
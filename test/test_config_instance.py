@@ -0,0 +1,81 @@
+# (c) 2016 Open Source Geospatial Foundation - all rights reserved
+# (c) 2014 - 2015 Centre for Maritime Research and Experimentation (CMRE)
+# (c) 2013 - 2014 German Aerospace Center (DLR)
+# This code is licensed under the GPL 2.0 license, available at the root
+# application directory.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from wpsremote import configInstance
+
+__author__ = "Alessio Fabiani"
+__copyright__ = "Copyright 2016 Open Source Geospatial Foundation - all rights reserved"
+__license__ = "GPL"
+
+
+class TestConfigInstance(unittest.TestCase):
+
+    def setUp(self):
+        configInstance._CONFIG_CACHE.clear()
+        self.tmp_dir = tempfile.mkdtemp()
+        self.config_file = os.path.join(self.tmp_dir, "service.config")
+        self.write_config("GdalContour", 0)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+        configInstance._CONFIG_CACHE.clear()
+
+    def write_config(self, service, mtime):
+        with open(self.config_file, "w") as f:
+            f.write("[DEFAULT]\nservice = %s\nworkdir = %%(output_dir)s/out\n\n" % service)
+            f.write("[Input1]\nclass = param\nname = interval\n")
+        os.utime(self.config_file, (mtime, mtime))
+
+    def test_cache_hit(self):
+        c1 = configInstance.create_cached(self.config_file, case_sensitive=True, raw=True)
+        c2 = configInstance.create_cached(self.config_file, case_sensitive=True, raw=True)
+        self.assertEquals(len(configInstance._CONFIG_CACHE), 1)
+        self.assertFalse(c1 is c2)
+        self.assertEquals(c1.sections(), c2.sections())
+        self.assertEquals(c2.get("DEFAULT", "service"), "GdalContour")
+        self.assertEquals(c1.items_without_defaults("Input1", raw=True),
+                          c2.items_without_defaults("Input1", raw=True))
+        c3 = configInstance.create(self.config_file, case_sensitive=True, raw=True)
+        self.assertEquals(c2.items("Input1", raw=True), c3.items("Input1", raw=True))
+
+    def test_options_are_part_of_the_key(self):
+        configInstance.create_cached(self.config_file, raw=True)
+        c = configInstance.create_cached(self.config_file, variables={'output_dir': '/tmp'})
+        self.assertEquals(c.get("DEFAULT", "workdir"), "/tmp/out")
+
+    def test_mtime_change_invalidates(self):
+        configInstance.create_cached(self.config_file)
+        # same size, different content and mtime
+        self.write_config("GdalContouX", 10)
+        c = configInstance.create_cached(self.config_file)
+        self.assertEquals(c.get("DEFAULT", "service"), "GdalContouX")
+        self.assertEquals(len(configInstance._CONFIG_CACHE), 1)
+
+    def test_size_change_invalidates(self):
+        configInstance.create_cached(self.config_file)
+        # same mtime, different size
+        self.write_config("GdalContourLines", 0)
+        c = configInstance.create_cached(self.config_file)
+        self.assertEquals(c.get("DEFAULT", "service"), "GdalContourLines")
+
+    def test_returned_copy_is_independent(self):
+        c1 = configInstance.create_cached(self.config_file, raw=True)
+        c1.set("Input1", "name", "changed")
+        c1.set("DEFAULT", "service", "changed")
+        c1.add_section("Output1")
+        c2 = configInstance.create_cached(self.config_file, raw=True)
+        self.assertEquals(c2.get("Input1", "name"), "interval")
+        self.assertEquals(c2.get("DEFAULT", "service"), "GdalContour")
+        self.assertFalse(c2.has_section("Output1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+# (c) 2016 Open Source Geospatial Foundation - all rights reserved
+# (c) 2014 - 2015 Centre for Maritime Research and Experimentation (CMRE)
+# (c) 2013 - 2014 German Aerospace Center (DLR)
+# This code is licensed under the GPL 2.0 license, available at the root
+# application directory.
+
+import unittest
+import json
+
+from wpsremote import resource_monitor
+
+__author__ = "Alessio Fabiani"
+__copyright__ = "Copyright 2016 Open Source Geospatial Foundation - all rights reserved"
+__license__ = "GPL"
+
+
+class TestResourceMonitor(unittest.TestCase):
+
+    def test_parse_proc_defs(self):
+        proc_defs = json.loads('[{"cwd": "/opt/app", "name": "celery", "cmdline": "-A app worker"}]')
+        res = resource_monitor.ResourceMonitor.parse_proc_defs(proc_defs)
+        self.assertEquals(res, frozenset([("celery", "/opt/app", "-A app worker")]))
+
+    def test_parse_proc_defs_missing_keys(self):
+        proc_defs = [{"name": "celery", "cwd": "/opt/app"},
+                     {"name": "celery", "cmdline": "-A app worker"},
+                     {"cwd": "/opt/app", "cmdline": "-A app worker"},
+                     {"name": "python", "cwd": "/tmp", "cmdline": "test.py"}]
+        res = resource_monitor.ResourceMonitor.parse_proc_defs(proc_defs)
+        self.assertEquals(res, frozenset([("python", "/tmp", "test.py")]))
+
+    def test_parse_proc_defs_malformed(self):
+        # not dicts
+        res = resource_monitor.ResourceMonitor.parse_proc_defs(["celery", 1, None, ["name", "cwd", "cmdline"]])
+        self.assertEquals(res, frozenset())
+        # a single object instead of a list
+        res = resource_monitor.ResourceMonitor.parse_proc_defs({"name": "celery", "cwd": "/", "cmdline": ""})
+        self.assertEquals(res, frozenset())
+        # empty list
+        self.assertEquals(resource_monitor.ResourceMonitor.parse_proc_defs([]), frozenset())
+        # null
+        self.assertRaises(TypeError, resource_monitor.ResourceMonitor.parse_proc_defs, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# (c) 2016 Open Source Geospatial Foundation - all rights reserved
+# (c) 2014 - 2015 Centre for Maritime Research and Experimentation (CMRE)
+# (c) 2013 - 2014 German Aerospace Center (DLR)
+# This code is licensed under the GPL 2.0 license, available at the root
+# application directory.
+
+import unittest
+
+from wpsremote import servicebot
+
+__author__ = "Alessio Fabiani"
+__copyright__ = "Copyright 2016 Open Source Geospatial Foundation - all rights reserved"
+__license__ = "GPL"
+
+TAG_LINE = b'[XMPP Disconnected]: Process <UID>uid-1</UID> Could not send error message ' \
+           b'to GeoServer Endpoint <JID>geoserver@localhost/wps</JID> <MSG>boom</MSG>'
+
+
+class TestParseProcessStdout(unittest.TestCase):
+
+    def parse(self, chunks):
+        """Run parse_process_stdout on the given chunks; return its result, the lines read and the reads done."""
+        chunks = list(chunks)
+        reads = []
+        lines = []
+
+        def read_chunk():
+            reads.append(1)
+            return chunks.pop(0) if chunks else b''
+
+        res = servicebot.parse_process_stdout(read_chunk, lines.append)
+        return res, lines, len(reads)
+
+    def test_no_tags(self):
+        res, lines, reads = self.parse([b'line 1\nline 2\n', b'line 3\n'])
+        self.assertEquals(res, (None, None, None))
+        self.assertEquals(lines, [b'line 1', b'line 2', b'line 3'])
+        self.assertEquals(reads, 3)
+
+    def test_tag_line(self):
+        res, lines, reads = self.parse([b'line 1\n' + TAG_LINE + b'\nline 3\n'])
+        self.assertEquals(res, (b'uid-1', b'geoserver@localhost/wps', b'boom'))
+        self.assertEquals(len(lines), 3)
+
+    def test_tag_line_split_across_chunks(self):
+        res, lines, reads = self.parse([b'line 1\n' + TAG_LINE[:40], TAG_LINE[40:90], TAG_LINE[90:] + b'\nline 3\n'])
+        self.assertEquals(res, (b'uid-1', b'geoserver@localhost/wps', b'boom'))
+        self.assertEquals(lines, [b'line 1', TAG_LINE, b'line 3'])
+
+    def test_last_line_without_newline(self):
+        res, lines, reads = self.parse([b'line 1\n', TAG_LINE])
+        self.assertEquals(res, (b'uid-1', b'geoserver@localhost/wps', b'boom'))
+        self.assertEquals(lines, [b'line 1', TAG_LINE])
+
+    def test_tags_out_of_order(self):
+        res, lines, reads = self.parse([b'<JID>gs@localhost</JID> <UID>uid-2</UID> <MSG>boom</MSG>\n'])
+        self.assertEquals(res, (b'uid-2', b'gs@localhost', b'boom'))
+
+    def test_partial_tags(self):
+        res, lines, reads = self.parse([b'<UID>uid-3</UID> <MSG>boom</MSG>\n'])
+        self.assertEquals(res, (b'uid-3', None, None))
+        res, lines, reads = self.parse([b'<MSG>boom</MSG> <UID>uid-4</UID> <JID>gs@localhost</JID>\n'])
+        self.assertEquals(res, (b'uid-4', b'gs@localhost', b'boom'))
+        res, lines, reads = self.parse([b'<JID>gs@localhost</JID> <MSG>boom</MSG>\n'])
+        self.assertEquals(res, (None, None, None))
+
+    def test_last_tags_win(self):
+        res, lines, reads = self.parse([TAG_LINE + b'\n', b'<UID>uid-5</UID><JID>gs@host</JID><MSG>again</MSG>\n'])
+        self.assertEquals(res, (b'uid-5', b'gs@host', b'again'))
+
+    def test_stop_on_send_error_msg_complete(self):
+        res, lines, reads = self.parse([TAG_LINE + b'\nDEBUG send error msg complete\n'
+                                        b'<UID>uid-6</UID><JID>gs@host</JID><MSG>ignored</MSG>\n',
+                                        b'never read\n'])
+        self.assertEquals(res, (b'uid-1', b'geoserver@localhost/wps', b'boom'))
+        self.assertEquals(lines, [TAG_LINE])
+        self.assertEquals(reads, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,3 +7,12 @@ python test/test_computation_job_inputs.py
 echo "Running... test_process_input_parameters"
 python test/test_process_input_parameters.py
 
+echo "Running... test_config_instance"
+python test/test_config_instance.py
+
+echo "Running... test_resource_monitor"
+python test/test_resource_monitor.py
+
+echo "Running... test_servicebot"
+python test/test_servicebot.py
+